@@ -1,33 +1,240 @@
 import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from functools import partial
 from playwright.async_api import async_playwright
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import aiohttp
-import aiofiles
+import hashlib
+import json
 import os
+import random
 import re
+import shutil
+import sys
 import time
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
 
 IMG_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
 MAX_PAGE_CONCURRENCY = 3
 MAX_DOWNLOAD_CONCURRENCY = 10
+MAX_PENDING_DOWNLOADS = MAX_DOWNLOAD_CONCURRENCY * 4
 MAX_RETRY = 2
 MAX_PAGE_RETRY = 2
-BATCH_SIZE = 5
+RETRY_BACKOFF = 1.0
+MAX_RETRY_AFTER = 60
+RETRYABLE_STATUS = frozenset({408, 425, 429, 500, 502, 503, 504})
+THROTTLE_STATUS = frozenset({429, 503})
+THROTTLE_WINDOW = 1.0
+CHUNK_SIZE = 64 * 1024
+SMALL_FILE_LIMIT = 256 * 1024
+PART_SUFFIX = ".part"
+WRITE_WORKERS = 8
+MANIFEST_NAME = "manifest.json"
+REPORT_INTERVAL = 0.1
+_BLOCKED = frozenset({"image", "stylesheet", "font", "media"})
+_BLOCKED_URL_RE = re.compile(r"\.(css|woff2?|ttf|png|jpe?g|gif|webp|svg|mp4)(\?|$)", re.I)
 
 
-def is_image_url(url):
-    return url.lower().endswith(IMG_EXTENSIONS)
+_IMG_EXT = frozenset(IMG_EXTENSIONS)
 
 
-async def spinner(msg="Processing"):
+def is_image_url(url):
+    # 只看 ? 之前最後一個副檔名，不必把整個網址轉小寫
+    path = url.partition("?")[0]
+    return path[path.rfind(".") :].lower() in _IMG_EXT
+
+
+_browser_future = None
+
+
+async def get_browser(p):
+    # 同時有多個協程要瀏覽器時只啟動一次 Chromium，斷線或啟動失敗才重開
+    global _browser_future
+    f = _browser_future
+    if f is not None and f.done():
+        if f.cancelled() or f.exception() or not f.result().is_connected():
+            _browser_future = None
+    if _browser_future is None:
+        _browser_future = asyncio.ensure_future(p.chromium.launch(headless=True))
+    return await _browser_future
+
+
+async def _blocker(route):
+    # 先用網址副檔名判斷，命中就不必再問 resource_type
+    if _BLOCKED_URL_RE.search(route.request.url):
+        await route.abort()
+    elif route.request.resource_type in _BLOCKED:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+# 可在執行中調整上限的號誌，被伺服器限流時降低併發，之後再慢慢放寬
+class DynSem:
+    def __init__(self, cap):
+        self.limit = cap
+        self.cap = cap
+        self._in = 0
+        self._ok = 0
+        self._throttled_at = float("-inf")
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in < self.cap)
+            self._in += 1
+
+    async def release(self):
+        self._in -= 1
+        async with self._cond:
+            self._cond.notify(1)
+
+    async def set_cap(self, n):
+        async with self._cond:
+            self.cap = max(1, min(n, self.limit))
+            self._cond.notify_all()
+
+    async def throttle(self):
+        # 同一波限流會同時回來好幾個 429，一個 THROTTLE_WINDOW 內只減半一次
+        self._ok = 0
+        now = asyncio.get_running_loop().time()
+        if now - self._throttled_at < THROTTLE_WINDOW:
+            return
+        self._throttled_at = now
+        await self.set_cap(self.cap // 2)
+
+    async def relax(self):
+        # 連續成功 cap 次才放寬一格
+        if self.cap >= self.limit:
+            return
+        self._ok += 1
+        if self._ok >= self.cap:
+            self._ok = 0
+            await self.set_cap(self.cap + 1)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+
+# 重複使用同一個 BrowserContext 裡的分頁，避免每篇文章都開新分頁
+class PagePool:
+    def __init__(self, context, size):
+        self.context = context
+        self.size = size
+        self._sem = DynSem(size)
+        self._idle = asyncio.Queue()
+
+    async def fill(self):
+        # 事先把分頁開好，第一批文章就不用等開分頁
+        pages = await asyncio.gather(
+            *(self.context.new_page() for _ in range(self.size - self._idle.qsize()))
+        )
+        for page in pages:
+            self._idle.put_nowait(page)
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._sem:
+            if self._idle.empty():
+                page = await self.context.new_page()
+            else:
+                page = self._idle.get_nowait()
+            try:
+                yield page
+            except BaseException:
+                # 出錯的分頁狀態不明，關掉換一個新的
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                raise
+            finally:
+                if page.is_closed():
+                    try:
+                        page = await self.context.new_page()
+                    except Exception:
+                        page = None
+                if page is not None:
+                    self._idle.put_nowait(page)
+
+    async def close(self):
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
+
+
+@dataclass
+class Stats:
+    done: int = 0
+    total: int = 0
+    ok_first: int = 0
+    ok_retry: int = 0
+    skip: int = 0
+    link: int = 0
+    fail_final: int = 0
+    err_final: int = 0
+
+
+_status_q = asyncio.Queue()
+
+
+def report(status, name):
+    # 下載協程只丟狀態進佇列，輸出交給 reporter
+    _status_q.put_nowait((status, name))
+
+
+async def reporter(stats, msg="Downloading images..."):
+    # 每 100ms 收集一次狀態，錯誤逐行印到 stdout；
+    # 進度行直接 os.write 到 stderr，輸出被導向檔案時就不顯示
+    counts = defaultdict(int)
+    tty = sys.stderr.isatty()
+    line = ""
+
+    def show(text):
+        if tty:
+            os.write(2, text.encode())
+
+    def flush_errors():
+        nonlocal line
+        lines = []
+        while not _status_q.empty():
+            status, name = _status_q.get_nowait()
+            counts[status] += 1
+            if status == "ERR":
+                lines.append(f"[ERR] {name}\n")
+        if lines:
+            show("\r" + " " * len(line) + "\r")
+            line = ""
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+
+    def status_line():
+        summary = " ".join(f"{k} {v}" for k, v in counts.items())
+        return f"[{stats.done}/{stats.total}] {summary}"
+
     try:
         while True:
             for char in r"-\|/":
-                print(f"\r{msg} {char}", end="", flush=True)
-                await asyncio.sleep(0.1)
+                await asyncio.sleep(REPORT_INTERVAL)
+                flush_errors()
+                line = f"{msg} {char} {status_line()}"
+                show(f"\r{line}")
     except asyncio.CancelledError:
-        print("\r" + " " * (len(msg) + 2) + "\r", end="", flush=True)
+        flush_errors()
+        show("\r" + " " * len(line) + "\r")
+        print(status_line())
 
 
 def date_text_to_timestamp(date_text):
@@ -38,317 +245,695 @@ def date_text_to_timestamp(date_text):
         return int(time.time())
 
 
+def load_manifest(save_dir):
+    try:
+        with open(os.path.join(save_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f).get("articles", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(save_dir, articles):
+    path = os.path.join(save_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"articles": articles}, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def scan_existing_files(save_dir):
+    # 一次讀完整個資料夾，之後只查集合，不用每張圖各做一次 stat
+    with os.scandir(save_dir) as it:
+        return {e.name for e in it if e.is_file()}
+
+
+def is_article_complete(entry, existing_files):
+    # 紀錄中的圖片全部都在才算完成
+    files = entry.get("files")
+    return bool(files) and all(name in existing_files for name in files)
+
+
+def parse_retry_after(value):
+    # Retry-After 可能是秒數或 HTTP 日期
+    if not value:
+        return 0
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return 0
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+# 寫檔專用的執行緒池，大小配合磁碟能同時處理的量
+WRITE_POOL = ThreadPoolExecutor(max_workers=WRITE_WORKERS, thread_name_prefix="write")
+
+
+def _write_bytes(path, data):
+    # 不經 Python 的緩衝層，整份資料直接寫進檔案
+    with open(path, "wb", buffering=0) as f:
+        view = memoryview(data)
+        while view:
+            view = view[f.write(view) :]
+
+
+def _remove_part(part_path):
+    # 一次刪除、不存在就算了，不必先查再刪
+    with suppress(FileNotFoundError):
+        os.remove(part_path)
+
+
+def _finish_part(part_path, save_path, mtime):
+    # 檢查是否 0 byte，改成正式檔名並設定修改時間，一次在執行緒裡做完
+    if os.path.getsize(part_path) == 0:
+        raise Exception("Empty file")
+    os.replace(part_path, save_path)
+    if mtime:
+        os.utime(save_path, (mtime, mtime))
+
+
+def _write_batch(batch):
+    # 同一個執行緒裡把整批小檔寫完，逐檔回傳錯誤（成功為 None）
+    errors = []
+    for part_path, save_path, data, mtime in batch:
+        try:
+            _write_bytes(part_path, data)
+            _finish_part(part_path, save_path, mtime)
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+
+_write_q = asyncio.Queue()
+
+
+async def writer():
+    # 收集同時完成的小檔，一批只進一次執行緒池
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _write_q.get()]
+        while not _write_q.empty():
+            batch.append(_write_q.get_nowait())
+        try:
+            errors = await loop.run_in_executor(
+                WRITE_POOL, _write_batch, [item[:4] for item in batch]
+            )
+        except Exception as e:
+            errors = [e] * len(batch)
+        for item, err in zip(batch, errors):
+            fut = item[4]
+            if fut.done():
+                continue
+            if err is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(err)
+
+
+async def write_small_file(part_path, save_path, data, mtime):
+    fut = asyncio.get_running_loop().create_future()
+    _write_q.put_nowait((part_path, save_path, data, mtime, fut))
+    await fut
+
+
+def link_or_copy(src, dst, mtime=None):
+    # 同一個檔案系統上用硬連結，不行就整個複製
+    # 硬連結和原檔共用 inode，修改時間只能是第一篇文章的日期；複製的才改成這篇的
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+        if mtime:
+            os.utime(dst, (mtime, mtime))
+
+
 async def download_image(
     session,
     url,
     save_dir,
-    progress,
+    stats,
     sem,
     failed_images,
     save_path_override=None,
-    stats=None,
     is_retry=False,
     mtime=None,  # 新增修改時間參數
+    source=None,
+    source_path=None,
+    existing_files=None,
 ):
+    # 同一個網址已在別篇文章下載過：等那個任務完成後直接連結過來
+    if source_path:
+        if source is None or await source:
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    WRITE_POOL, link_or_copy, source_path, save_path_override, mtime
+                )
+                if existing_files is not None:
+                    existing_files.add(os.path.basename(save_path_override))
+                stats.done += 1
+                stats.link += 1
+                report("LINK", os.path.basename(save_path_override))
+                return True
+            except OSError:
+                pass
+
     async with sem:
+        save_path = None
+        retryable = True
+        retry_after = 0
         try:
             save_path = save_path_override or os.path.join(
                 save_dir, url.split("/")[-1].split("?")[0]
             )
 
-            # 已存在檔案不重抓
-            if os.path.exists(save_path):
-                progress["done"] += 1
-                print(
-                    f"\r[{progress['done']}/{progress['total']}] SKIP {os.path.basename(save_path)}"
-                )
-                if stats:
-                    stats["SKIP"] += 1
-                return True
-
             async with session.get(url) as resp:
                 if resp.status == 200:
-                    async with aiofiles.open(save_path, "wb") as f:
-                        await f.write(await resp.read())
-
-                    # 檢查是否 0 byte
-                    if os.path.getsize(save_path) == 0:
-                        raise Exception("Empty file")
-
-                    # 設定檔案修改時間
-                    if mtime:
-                        os.utime(save_path, (mtime, mtime))
-
-                    progress["done"] += 1
-                    print(
-                        f"\r[{progress['done']}/{progress['total']}] OK {os.path.basename(save_path)}"
-                    )
-                    if stats:
-                        stats["OK_retry" if is_retry else "OK_first"] += 1
+                    # 先寫到 .part，完整收完才改名，中斷時不會留下半截的圖
+                    part_path = save_path + PART_SUFFIX
+                    # 小檔讀完後交給 writer 成批寫入，大檔邊收邊寫
+                    if (
+                        resp.content_length is not None
+                        and resp.content_length < SMALL_FILE_LIMIT
+                    ):
+                        body = await resp.read()
+                        await write_small_file(part_path, save_path, body, mtime)
+                    else:
+                        loop = asyncio.get_running_loop()
+                        f = await loop.run_in_executor(WRITE_POOL, open, part_path, "wb")
+                        try:
+                            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                                await loop.run_in_executor(WRITE_POOL, f.write, chunk)
+                        finally:
+                            await loop.run_in_executor(WRITE_POOL, f.close)
+                        await loop.run_in_executor(
+                            WRITE_POOL, _finish_part, part_path, save_path, mtime
+                        )
+                    if existing_files is not None:
+                        existing_files.add(os.path.basename(save_path))
+
+                    await sem.relax()
+                    stats.done += 1
+                    if is_retry:
+                        stats.ok_retry += 1
+                    else:
+                        stats.ok_first += 1
+                    report("OK", os.path.basename(save_path))
                     return True
                 else:
+                    # 只有暫時性錯誤值得重試，404 之類直接算失敗
+                    if resp.status in RETRYABLE_STATUS:
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        if resp.status in THROTTLE_STATUS:
+                            await sem.throttle()
+                    else:
+                        retryable = False
                     raise Exception(f"http status {resp.status}")
 
         except Exception as e:
-            progress["done"] += 1
-            print(f"\r[{progress['done']}/{progress['total']}] ERR {url} {e}")
-            failed_images.append(url)
-            if is_retry and stats:
-                stats["ERR_final"] += 1
+            # 刪掉寫到一半的暫存檔
+            if save_path:
+                await asyncio.get_running_loop().run_in_executor(
+                    WRITE_POOL, _remove_part, save_path + PART_SUFFIX
+                )
+            stats.done += 1
+            report("ERR", f"{url} {e}")
+            if retryable:
+                failed_images.append((url, save_path, mtime, retry_after))
+            else:
+                stats.fail_final += 1
             return False
 
 
-async def get_article_links(page, base_url):
-    elements = await page.query_selector_all("article a")
-    return [
-        urljoin(base_url, await a.get_attribute("href"))
-        for a in elements
-        if await a.get_attribute("href")
+_SANITIZE_TABLE = str.maketrans({c: "_" for c in '\\/:*?"<>|'})
+_POST_ID_RE = re.compile(r"/post/(\d+)")
+_DIGIT_RE = re.compile(r"\d")
+_SHOWING_RE = re.compile(r"Showing\s+\d+\s*-\s*\d+\s+of\s+(\d+)")
+
+
+# 一次把所有連結從頁面取回來，不要每個元素各跑一趟；
+# e.href 由瀏覽器依 document.baseURI 轉成絕對網址
+HREFS_JS = "els => els.map(e => e.href).filter(Boolean)"
+
+# 有裝 selectolax 就先試靜態 HTML，發現是前端渲染才改回 Playwright
+_static_html = HTMLParser is not None
+# 靜態 HTML 不經過分頁池，自己限制同時抓的頁數，和 Playwright 一樣最多 MAX_PAGE_CONCURRENCY
+_html_sem = asyncio.Semaphore(MAX_PAGE_CONCURRENCY)
+
+
+async def get_article_links(page):
+    return await page.eval_on_selector_all("article a", HREFS_JS)
+
+
+async def get_image_links(page):
+    hrefs = await page.eval_on_selector_all("a", HREFS_JS)
+    return [u for u in hrefs if is_image_url(u)]
+
+
+def html_hrefs(tree, selector):
+    return [h for h in (n.attributes.get("href") for n in tree.css(selector)) if h]
+
+
+async def fetch_html(session, url):
+    if not _static_html:
+        return None
+    try:
+        async with _html_sem:
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    return None
+                text = await resp.text()
+    except Exception:
+        return None
+    return HTMLParser(text)
+
+
+async def read_listing_static(session, page_url):
+    global _static_html
+    tree = await fetch_html(session, page_url)
+    if tree is None:
+        return None
+    hrefs = html_hrefs(tree, "article a")
+    if not hrefs:
+        # 靜態 HTML 裡沒有文章列表，之後都直接用 Playwright
+        _static_html = False
+        return None
+    return list(map(partial(urljoin, page_url), hrefs))
+
+
+async def read_article_static(session, link):
+    # 回傳 (標題, 日期文字, 是否有 figure, 圖片網址)，與 read_article_page 相同
+    global _static_html
+    tree = await fetch_html(session, link)
+    if tree is None:
+        return None
+    title_el = tree.css_first("h1.post__title")
+    figure = tree.css_first("figure")
+    if title_el is None and figure is None:
+        _static_html = False
+        return None
+    time_el = tree.css_first("time.timestamp")
+    img_urls = [
+        u
+        for u in map(partial(urljoin, link), html_hrefs(tree, "a"))
+        if is_image_url(u)
     ]
+    return (
+        title_el.text() if title_el else "",
+        time_el.text() if time_el else "",
+        figure is not None,
+        img_urls,
+    )
 
 
-async def get_image_links(page, base_url):
-    elements = await page.query_selector_all("a")
-    img_urls = []
-    for a in elements:
-        href = await a.get_attribute("href")
-        if href:
-            full_url = urljoin(base_url, href)
-            if is_image_url(full_url):
-                img_urls.append(full_url)
-    return img_urls
+async def read_article_page(page):
+    # 文章標題
+    try:
+        await page.wait_for_selector("h1.post__title", timeout=10000)
+    except:
+        pass
+    title_el = await page.query_selector("h1.post__title")
+    time_el = await page.query_selector("time.timestamp")
+    return (
+        await title_el.inner_text() if title_el else "",
+        await time_el.inner_text() if time_el else "",
+        await page.query_selector("figure") is not None,
+        await get_image_links(page),
+    )
 
 
 async def process_article_page(
     link,
-    browser,
+    pool,
     session,
-    progress,
+    stats,
     download_sem,
     failed_images,
-    stats,
-    existing_titles,
+    title_counts,
     save_dir,
+    existing_files,
     url_to_path,
+    url_futures,
+    manifest,
+    download_tasks,
+    pending_sem,
 ):
+    use_static = True
     for attempt in range(MAX_PAGE_RETRY + 1):
-        page = await browser.new_page()
-        try:
-            await page.route(
-                "**/*",
-                lambda route: (
-                    route.abort()
-                    if route.request.resource_type in ["image", "stylesheet", "font"]
-                    else route.continue_()
-                ),
+        article = await read_article_static(session, link) if use_static else None
+        if article is not None and not article[2]:
+            # 標題在靜態 HTML 裡但圖是前端才渲染，重抓同一份 HTML 沒用，直接改用 Playwright
+            use_static = False
+            article = None
+        if article is None:
+            async with pool.acquire() as page:
+                try:
+                    await page.goto(link, wait_until="domcontentloaded", timeout=20000)
+                except Exception as e:
+                    if attempt < MAX_PAGE_RETRY:
+                        await asyncio.sleep(2)
+                        continue
+                    else:
+                        print(f"\nFailed to open {link} after retries: {e}")
+                        return
+                article = await read_article_page(page)
+        raw_title, raw_date, has_figures, img_urls = article
+
+        if not has_figures:
+            if attempt < MAX_PAGE_RETRY:
+                await asyncio.sleep(1)
+                continue
+            else:
+                print(f"\nNo figure found on {link}")
+                return
+
+        # 靜態 HTML 的 text() 會留下換行和縮排，壓成單一空白，兩條路徑的檔名才一致
+        title = " ".join(raw_title.split()).translate(_SANITIZE_TABLE) or "untitled"
+
+        # 取得文章發布日期
+        date_text = "".join(_DIGIT_RE.findall(raw_date))[:8] or "00000000"
+        timestamp = date_text_to_timestamp(date_text)
+
+        if title.startswith("untitled"):
+            uid = _POST_ID_RE.search(link)
+            # hash() 每次執行結果不同，改用固定的短雜湊讓檔名可重現
+            uid = (
+                uid.group(1)
+                if uid
+                else hashlib.blake2b(link.encode(), digest_size=6).hexdigest()
             )
-            try:
-                await page.goto(link, wait_until="domcontentloaded", timeout=20000)
-            except Exception as e:
-                if attempt < MAX_PAGE_RETRY:
-                    await asyncio.sleep(2)
-                    continue
-                else:
-                    print(f"\nFailed to open {link} after retries: {e}")
-                    return
-
-            # 文章標題
-            try:
-                await page.wait_for_selector("h1.post__title", timeout=10000)
-            except:
-                pass
-
-            title_element = await page.query_selector("h1.post__title")
-            title = (
-                await title_element.inner_text() if title_element else "untitled"
-            ).strip()
-            title = re.sub(r"[\\/:\*\?\"<>|]", "_", title) or "untitled"
-
-            # 取得文章發布日期
-            date_text = "00000000"
-            time_el = await page.query_selector("time.timestamp")
-            if time_el:
-                raw = (await time_el.inner_text()).strip()
-                date_text = "".join(re.findall(r"\d", raw))[:8] or "00000000"
-            timestamp = date_text_to_timestamp(date_text)
-
-            if title.startswith("untitled"):
-                uid = re.search(r"/post/(\d+)", link)
-                uid = uid.group(1) if uid else str(hash(link))
-                title = f"{title}_{uid}"
-
+            title = f"{title}_{uid}"
+
+        entry = manifest.get(link)
+        if entry:
+            # 之前處理過的文章沿用當時的標題，續傳時檔名才會一致
+            title = entry["title"]
+        else:
+            # 每個標題記下已用次數，重複時直接接上編號
             base_title = title
-            suffix = 1
-            while title in existing_titles:
-                title = f"{base_title}_{suffix}"
-                suffix += 1
-            existing_titles.add(title)
-
-            figures = await page.query_selector_all("figure")
-            if not figures:
-                if attempt < MAX_PAGE_RETRY:
-                    await asyncio.sleep(1)
-                    continue
-                else:
-                    print(f"\nNo figure found on {link}")
-                    return
-
-            img_urls = sorted(await get_image_links(page, link))
-            progress["total"] += len(img_urls)
-
-            tasks = []
-            for idx, img in enumerate(img_urls, start=1):
-                ext = os.path.splitext(img)[1].split("?")[0] or ".jpg"
-                filename = f"{title}_{idx}{ext}"
-                save_path = os.path.join(save_dir, filename)
+            n = title_counts[base_title]
+            while n and title in title_counts:
+                title = f"{base_title}_{n}"
+                n += 1
+            title_counts[base_title] = max(n, 1)
+            if title != base_title:
+                title_counts[title] += 1
+
+        # 同一篇常有縮圖和原圖指向同一網址，只留一份，免得兩個下載搶寫同一個檔
+        img_urls = sorted(dict.fromkeys(img_urls))
+        stats.total += len(img_urls)
+
+        files = []
+        manifest[link] = {"title": title, "files": files}
+        # 目錄和標題在同一篇裡固定，前綴先組好，迴圈裡只接編號和副檔名
+        save_dir_prefix = save_dir + os.sep
+        name_prefix = title + "_"
+        for idx, img in enumerate(img_urls, start=1):
+            # 副檔名只看網址的路徑部分，查詢字串裡的 ?f=xxx.png 不算
+            ext = os.path.splitext(urlsplit(img).path)[1] or ".jpg"
+            filename = name_prefix + str(idx) + ext
+            files.append(filename)
+            save_path = save_dir_prefix + filename
+
+            # 已存在檔案不重抓，也不必排隊佔用下載名額
+            if filename in existing_files:
+                url_to_path.setdefault(img, save_path)
+                stats.done += 1
+                stats.skip += 1
+                report("SKIP", filename)
+                continue
+
+            # 下載另外排程，分頁可以馬上交給下一篇文章
+            # 排隊中的下載有上限，超過就先等，不會一口氣堆出上萬個協程；
+            # 要先拿到名額再查網址，登記路徑和任務之間不能讓出控制權，
+            # 否則別篇文章會拿到還沒寫出來的路徑，以為檔案已經在了
+            await pending_sem.acquire()
+
+            # 第一次出現的網址才真的下載，之後的都從第一份連結
+            source = url_futures.get(img)
+            source_path = url_to_path.get(img)
+            if source_path is None:
                 url_to_path[img] = save_path
-                tasks.append(
-                    download_image(
-                        session,
-                        img,
-                        save_dir,
-                        progress,
-                        download_sem,
-                        failed_images,
-                        save_path_override=save_path,
-                        stats=stats,
-                        mtime=timestamp,  # 設定修改時間
-                    )
+
+            task = asyncio.create_task(
+                download_image(
+                    session,
+                    img,
+                    save_dir,
+                    stats,
+                    download_sem,
+                    failed_images,
+                    save_path_override=save_path,
+                    mtime=timestamp,  # 設定修改時間
+                    source=source,
+                    source_path=source_path,
+                    existing_files=existing_files,
                 )
-            await asyncio.gather(*tasks)
-            break
-        finally:
-            await page.close()
+            )
+            if source_path is None:
+                url_futures[img] = task
+            download_tasks.add(task)
+            task.add_done_callback(download_tasks.discard)
+            task.add_done_callback(lambda _: pending_sem.release())
+        break
 
 
 async def main():
     base_url = input("URL? ")
     os.makedirs("imgs", exist_ok=True)
 
-    connector = aiohttp.TCPConnector(ssl=False)
+    # 圖片幾乎都在同一台主機，保持連線並快取 DNS；實際併發仍由 download_sem 控制
+    # 圖片最多佔 MAX_DOWNLOAD_CONCURRENCY 條（download_sem），總數和單一主機都多留
+    # MAX_PAGE_CONCURRENCY 條，圖片和頁面同主機時靜態 HTML 也不會被圖片下載卡住
+    connector = aiohttp.TCPConnector(
+        ssl=False,
+        limit=MAX_DOWNLOAD_CONCURRENCY + MAX_PAGE_CONCURRENCY,
+        limit_per_host=MAX_DOWNLOAD_CONCURRENCY + MAX_PAGE_CONCURRENCY,
+        use_dns_cache=True,
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+        force_close=False,
+        enable_cleanup_closed=True,
+    )
     timeout = aiohttp.ClientTimeout(total=60)
-    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+    headers = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout, headers=headers
+    ) as session:
         async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-            await page.goto(base_url)
-            await page.wait_for_load_state("networkidle")
-
-            text = await page.inner_text("body")
-            match = re.search(r"Showing\s+\d+\s*-\s*\d+\s+of\s+(\d+)", text)
-            total_items = int(match.group(1)) if match else 0
-
-            # 抓作者名
-            try:
-                await page.wait_for_selector("span[itemprop='name']", timeout=10000)
-            except:
-                pass
-            author_el = await page.query_selector("span[itemprop='name']")
-            author_name = await author_el.inner_text() if author_el else "unknown"
+            browser = await get_browser(p)
+            context = await browser.new_context()
+            await context.route("**/*", _blocker)
+            pool = PagePool(context, MAX_PAGE_CONCURRENCY)
+            await pool.fill()
+
+            async with pool.acquire() as page:
+                await page.goto(base_url, wait_until="domcontentloaded")
+                try:
+                    await page.wait_for_selector("article", timeout=10000)
+                except:
+                    pass
+
+                # 只讀分頁提示那一個元素，不必把整個 body 的文字拉回來
+                async def read_total_items():
+                    count_el = page.locator(
+                        r"text=/Showing\s+\d+\s*-\s*\d+\s+of\s+\d+/"
+                    ).first
+                    # 分頁提示可能比文章晚一點才出現，和作者名一樣等一下
+                    try:
+                        await count_el.wait_for(timeout=10000)
+                    except:
+                        return 0
+                    text = await count_el.inner_text()
+                    match = _SHOWING_RE.search(text)
+                    return int(match.group(1)) if match else 0
+
+                # 抓作者名
+                async def read_author_name():
+                    try:
+                        await page.wait_for_selector(
+                            "span[itemprop='name']", timeout=10000
+                        )
+                    except:
+                        pass
+                    author_el = await page.query_selector("span[itemprop='name']")
+                    return await author_el.inner_text() if author_el else "unknown"
+
+                # 第一頁已經打開了，文章連結順便一起抓
+                first_links, total_items, author_name = await asyncio.gather(
+                    get_article_links(page),
+                    read_total_items(),
+                    read_author_name(),
+                )
             author_name = (
-                re.sub(r"[\\/:\*\?\"<>|]", "_", author_name).strip() or "unknown"
+                author_name.translate(_SANITIZE_TABLE).strip() or "unknown"
             )
             save_dir = os.path.join("imgs", author_name)
             os.makedirs(save_dir, exist_ok=True)
-            await page.close()
 
             print(f"Author: {author_name}")
             print(f"Total articles found: {total_items}")
 
-            page_urls = [base_url] + [
+            page_urls = [
                 f"{base_url}?o={offset}" for offset in range(50, total_items, 50)
             ]
-            print(f"Total pages: {len(page_urls)}")
-
-            article_links_all = []
-            page_semaphore = asyncio.Semaphore(MAX_PAGE_CONCURRENCY)
+            print(f"Total pages: {len(page_urls) + 1}")
 
             async def fetch_article_links(page_url):
-                async with page_semaphore:
-                    page = await browser.new_page()
+                links = await read_listing_static(session, page_url)
+                if links is not None:
+                    return links
+                async with pool.acquire() as page:
+                    await page.goto(page_url, wait_until="domcontentloaded")
+                    await page.wait_for_selector("article", timeout=10000)
+                    return await get_article_links(page)
+
+            stats = Stats()
+            download_sem = DynSem(MAX_DOWNLOAD_CONCURRENCY)
+            failed_images = deque()
+            title_counts = defaultdict(int)
+            url_to_path = {}
+            url_futures = {}
+
+            # 先把紀錄中的標題都佔住，新文章才不會搶到舊文章的檔名
+            manifest = load_manifest(save_dir)
+            for entry in manifest.values():
+                title_counts[entry["title"]] += 1
+            existing_files = scan_existing_files(save_dir)
+
+            article_q = asyncio.Queue()
+            download_tasks = set()
+            pending_sem = asyncio.Semaphore(MAX_PENDING_DOWNLOADS)
+            queued_links = set()
+            skipped_articles = 0
+
+            def enqueue_articles(links):
+                # 上次已完整下載的文章不必再開頁面
+                nonlocal skipped_articles
+                for link in links:
+                    if link in queued_links:
+                        continue
+                    queued_links.add(link)
+                    entry = manifest.get(link)
+                    if entry and is_article_complete(entry, existing_files):
+                        skipped_articles += 1
+                        stats.done += len(entry["files"])
+                        stats.total += len(entry["files"])
+                        stats.skip += len(entry["files"])
+                    else:
+                        article_q.put_nowait(link)
+
+            async def article_worker():
+                while True:
+                    link = await article_q.get()
                     try:
-                        await page.goto(page_url)
-                        await page.wait_for_selector("article", timeout=10000)
-                        return await get_article_links(page, page_url)
+                        await process_article_page(
+                            link,
+                            pool,
+                            session,
+                            stats,
+                            download_sem,
+                            failed_images,
+                            title_counts,
+                            save_dir,
+                            existing_files,
+                            url_to_path,
+                            url_futures,
+                            manifest,
+                            download_tasks,
+                            pending_sem,
+                        )
+                    except Exception as e:
+                        print(f"\nFailed to process {link}: {e}")
                     finally:
-                        await page.close()
-
-            spinner_task = asyncio.create_task(spinner("Fetching pages..."))
-            results = await asyncio.gather(*[fetch_article_links(u) for u in page_urls])
-            spinner_task.cancel()
-            await asyncio.sleep(0.1)
+                        article_q.task_done()
 
-            for r in results:
-                article_links_all.extend(r)
-
-            print(f"Total article links collected: {len(article_links_all)}")
-
-            progress = {"done": 0, "total": 0}
-            stats = {
-                "OK_first": 0,
-                "OK_retry": 0,
-                "SKIP": 0,
-                "FAIL_final": 0,
-                "ERR_final": 0,
-            }
-            download_sem = asyncio.Semaphore(MAX_DOWNLOAD_CONCURRENCY)
-            failed_images = []
-            existing_titles = set()
-            url_to_path = {}
+            reporter_task = asyncio.create_task(reporter(stats))
+            writer_task = asyncio.create_task(writer())
+            workers = [
+                asyncio.create_task(article_worker())
+                for _ in range(MAX_PAGE_CONCURRENCY)
+            ]
 
-            spinner_task = asyncio.create_task(spinner("Downloading images..."))
-            for i in range(0, len(article_links_all), BATCH_SIZE):
-                batch = article_links_all[i : i + BATCH_SIZE]
-                tasks = [
-                    process_article_page(
-                        link,
-                        browser,
-                        session,
-                        progress,
-                        download_sem,
-                        failed_images,
-                        stats,
-                        existing_titles,
-                        save_dir,
-                        url_to_path,
-                    )
-                    for link in batch
-                ]
-                await asyncio.gather(*tasks)
-            spinner_task.cancel()
-            await asyncio.sleep(0.1)
+            # 列表頁一抓完就把文章丟進佇列，不必等所有列表頁都回來
+            enqueue_articles(first_links)
+            for fut in asyncio.as_completed([fetch_article_links(u) for u in page_urls]):
+                try:
+                    enqueue_articles(await fut)
+                except Exception as e:
+                    print(f"\nFailed to fetch listing page: {e}")
+            print(f"\nTotal article links collected: {len(queued_links)}")
+            if skipped_articles:
+                print(f"Skipping {skipped_articles} completed articles from manifest")
+
+            await article_q.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*download_tasks)
 
             # retry failed images
             for attempt in range(MAX_RETRY):
                 if not failed_images:
                     break
-                current_failed = []
-                tasks = [
-                    download_image(
-                        session,
-                        url,
-                        save_dir,
-                        progress,
-                        download_sem,
-                        current_failed,
-                        save_path_override=url_to_path.get(url),
-                        stats=stats,
-                        is_retry=True,
+                # 指數退避加抖動，伺服器有給 Retry-After 就至少等那麼久
+                delay = RETRY_BACKOFF * 2**attempt + random.random() * 0.3
+                delay = max(delay, *(ra for *_, ra in failed_images))
+                await asyncio.sleep(delay)
+                # 同一網址這一輪只重抓一次，其餘等它完成後再連結過去
+                # 任務要到下面 await 才開始跑，這裡先把本輪的項目取光，
+                # 這輪再失敗的會接著放回同一個 deque 給下一輪
+                seen_urls = {}
+                tasks = []
+                while failed_images:
+                    url, save_path, mtime, _ = failed_images.popleft()
+                    first = seen_urls.get(url)
+                    task = asyncio.create_task(
+                        download_image(
+                            session,
+                            url,
+                            save_dir,
+                            stats,
+                            download_sem,
+                            failed_images,
+                            save_path_override=save_path,
+                            is_retry=True,
+                            mtime=mtime,
+                            source=first and first[0],
+                            source_path=first and first[1],
+                            existing_files=existing_files,
+                        )
                     )
-                    for url in failed_images
-                ]
-                await asyncio.gather(*tasks)
-                failed_images = current_failed
+                    if first is None:
+                        seen_urls[url] = (task, save_path)
+                    tasks.append(task)
+                for fut in asyncio.as_completed(tasks):
+                    await fut
+            stats.err_final += len(failed_images)
+            writer_task.cancel()
+            reporter_task.cancel()
+            await asyncio.sleep(0.1)
 
-            print("\nDownload summary:")
-            print("OK_first :", stats["OK_first"])
-            print("OK_retry :", stats["OK_retry"])
-            print("SKIP     :", stats["SKIP"])
-            print("FAIL_fin :", stats["FAIL_final"])
-            print("ERR_fin  :", stats["ERR_final"])
+            save_manifest(save_dir, manifest)
 
+            print("\nDownload summary:")
+            print("OK_first :", stats.ok_first)
+            print("OK_retry :", stats.ok_retry)
+            print("SKIP     :", stats.skip)
+            print("LINK     :", stats.link)
+            print("FAIL_fin :", stats.fail_final)
+            print("ERR_fin  :", stats.err_final)
+
+            await pool.close()
+            await context.close()
             await browser.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # 有裝 uvloop 就用較快的事件迴圈（Windows 不支援，沒有就用預設的）
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
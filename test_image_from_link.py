@@ -0,0 +1,86 @@
+import asyncio
+from collections import defaultdict, deque
+
+import pytest
+
+pytest.importorskip("playwright")
+pytest.importorskip("aiohttp")
+
+import image_from_link as ifl
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+    def __init__(self, body):
+        self.body = body
+        self.content_length = len(body)
+
+    async def read(self):
+        await asyncio.sleep(0.01)
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = defaultdict(int)
+
+    def get(self, url):
+        self.calls[url] += 1
+        return FakeResponse(url.encode())
+
+
+def test_shared_url_downloaded_once_when_pending_bound_is_full(tmp_path, monkeypatch):
+    shared = "https://img.example/z.jpg"
+    articles = {
+        "https://example/post/1": ["https://img.example/a1.jpg", "https://img.example/a2.jpg", shared],
+        "https://example/post/2": [shared],
+    }
+
+    async def fake_read_article_static(session, link):
+        return (link.rsplit("/", 1)[-1], "2024-01-02", True, articles[link])
+
+    monkeypatch.setattr(ifl, "read_article_static", fake_read_article_static)
+
+    async def run():
+        session = FakeSession()
+        stats = ifl.Stats()
+        download_tasks = set()
+        # 名額比第一篇的圖少，第一篇會卡在共用的那張上
+        pending_sem = asyncio.Semaphore(2)
+        args = (
+            None,
+            session,
+            stats,
+            ifl.DynSem(ifl.MAX_DOWNLOAD_CONCURRENCY),
+            deque(),
+            defaultdict(int),
+            str(tmp_path),
+            set(),
+            {},
+            {},
+            {},
+            download_tasks,
+            pending_sem,
+        )
+        writer_task = asyncio.create_task(ifl.writer())
+        try:
+            await asyncio.gather(
+                *(ifl.process_article_page(link, *args) for link in articles)
+            )
+            await asyncio.gather(*download_tasks)
+        finally:
+            writer_task.cancel()
+        return session, stats
+
+    session, stats = asyncio.run(run())
+    assert session.calls[shared] == 1
+    assert stats.link == 1
+    assert stats.ok_first == 3